@@ -5,10 +5,15 @@ FastAPI server for Realtime API with WebSocket support
 
 from __future__ import annotations
 
+import os
+import base64
 import asyncio
-import json
+import logging
 from typing import Any
+from collections import deque
+from contextlib import asynccontextmanager
 
+import orjson
 from dotenv import load_dotenv
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
@@ -20,532 +25,701 @@ from openai.types.realtime.session_updated_event import Session
 from prompt import SYSTEM_PROMPT
 from tools.multiply import get_multiply_tool_definition, execute_multiply
 
-# Import for conversation item creation (for tool outputs)
-try:
-    from openai.types.beta.realtime.conversation_item_param import ConversationItemParam
-except ImportError:
-    # Fallback for different SDK versions
-    try:
-        from openai.types.realtime.conversation_item_param import ConversationItemParam
-    except ImportError:
-        # If both fail, we'll use dict format
-        ConversationItemParam = None
-
 project_root = Path(__file__).parent
 load_dotenv(dotenv_path=project_root / ".env")
 
-app = FastAPI()
 
-# Enable CORS for React frontend
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    # Don't leave pre-warmed Realtime connections open past shutdown
+    await realtime_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Enable CORS for React frontend (HTTP only - the middleware passes WebSocket scopes straight through)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://localhost:3000"],  # Vite default port
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET"],  # The HTTP API is read-only
+    allow_headers=["Content-Type"],
 )
 
 client = AsyncOpenAI()
 
+logger = logging.getLogger(__name__)
+
+# MEDIMINDS_DEBUG=1 turns on debug logging; with it off the per-event debug dumps are never built
+_DEBUG = os.getenv("MEDIMINDS_DEBUG") == "1"
+if _DEBUG:
+    logger.setLevel(logging.DEBUG)
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+
+# Session configuration with server VAD and medical assistant prompt, shared by every client
+SESSION_CONFIG = {
+    "instructions": SYSTEM_PROMPT,
+    "voice": "sage",  # Professional and warm voice
+    "temperature": 0.7,  # Balanced between consistency and naturalness
+    "max_response_output_tokens": 4096,
+    "tools": [get_multiply_tool_definition()],
+    "tool_choice": "auto",  # Enable automatic tool calling
+    "turn_detection": {"type": "server_vad"},  # Match example pattern
+    "input_audio_transcription": {"model": "whisper-1"},  # Match example
+    "input_audio_format": "pcm16",  # Match example
+    "model": "gpt-realtime",
+    "type": "realtime",
+}
+
+# response.create events, serialized once - tools are left out since they're already in session.update
+RESPONSE_CREATE_FRAME = orjson.dumps({"type": "response.create", "response": {"instructions": SYSTEM_PROMPT}}).decode()
+ERROR_RESPONSE_FRAME = orjson.dumps(
+    {
+        "type": "response.create",
+        "response": {"instructions": "Inform the user that there was an error with the calculation."},
+    }
+).decode()
+
+# Realtime connections kept opened and configured ahead of the next client (0 turns pre-warming off)
+REALTIME_POOL_SIZE = int(os.getenv("MEDIMINDS_REALTIME_POOL_SIZE", "2"))
+# Pre-warmed connections idle this long are closed, and only replaced on the next acquire
+REALTIME_POOL_MAX_IDLE = float(os.getenv("MEDIMINDS_REALTIME_POOL_MAX_IDLE", "600"))
+
+# Longest start_recording waits for upstream to acknowledge a response.cancel
+CANCEL_TIMEOUT = 0.05
+
+# Max outbound messages buffered per client before senders wait on the writer
+OUT_QUEUE_SIZE = 256
+# Max inbound audio chunks buffered per client; the oldest is dropped (and the client sent an overload) when upstream falls behind
+UPSTREAM_QUEUE_SIZE = 32
+
+
+def _append_to_batch(batch: list[dict], message: dict):
+    """Append a message to an outbound batch, merging consecutive deltas of the same item"""
+    last = batch[-1]
+    message_type = message["type"]
+    if (
+        message_type in ("audio_delta", "transcript_delta")
+        and last["type"] == message_type
+        and last["item_id"] == message["item_id"]
+        # Base64 strings only concatenate cleanly when the first one has no padding
+        and not (message_type == "audio_delta" and last["delta"].endswith("="))
+    ):
+        batch[-1] = {**last, "delta": last["delta"] + message["delta"]}
+    else:
+        batch.append(message)
+
+
+async def _submit_tool_output(conn: AsyncRealtimeConnection, call_id: str, output: str):
+    """Add a function_call_output item to the conversation"""
+    await conn.conversation.item.create(
+        item={
+            "type": "function_call_output",
+            "call_id": call_id,
+            "output": output,
+        }
+    )
+
+
+class RealtimeConnectionPool:
+    """Keeps Realtime connections opened and session-configured before clients ask for them
+
+    Each connection carries its own conversation, so it is handed to exactly one client and
+    closed afterwards - never returned to the pool. The pool fills up on acquire() and drains
+    when no client comes for REALTIME_POOL_MAX_IDLE, so an idle server holds no upstream sessions.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        # (opened at, connection, resolved once a client takes it)
+        self._idle: deque[tuple[float, AsyncRealtimeConnection, asyncio.Future[None]]] = deque()
+        self._warming: set[asyncio.Task[None]] = set()
+        self._opening = 0
+        self._closed = False
+
+    async def acquire(self) -> AsyncRealtimeConnection:
+        loop = asyncio.get_running_loop()
+        conn = None
+        while self._idle:
+            created, idle_conn, taken = self._idle.popleft()
+            if taken.done():
+                # Its _warm task timed out but will find the entry gone - close it here instead
+                await _close_quietly(idle_conn)
+                continue
+            # Release its _warm task whether or not the connection is usable
+            taken.set_result(None)
+            if loop.time() - created < REALTIME_POOL_MAX_IDLE and _is_open(idle_conn):
+                conn = idle_conn
+                break
+            # Expired or dropped by the server - handing it out would end the session at once
+            await _close_quietly(idle_conn)
+
+        self._refill()
+        if conn is None:
+            # Pool is cold - open one inline
+            conn = await self._open()
+        return conn
+
+    async def close(self):
+        """Stop warming connections and close the idle ones"""
+        self._closed = True
+        for task in self._warming:
+            task.cancel()
+        while self._idle:
+            _, conn, _ = self._idle.popleft()
+            await _close_quietly(conn)
+
+    def _refill(self):
+        while not self._closed and len(self._idle) + self._opening < self.size:
+            # Counted here since the task only starts once this loop yields
+            self._opening += 1
+            task = asyncio.create_task(self._warm())
+            self._warming.add(task)
+            task.add_done_callback(self._warming.discard)
+
+    async def _warm(self):
+        """Open a connection into the pool, closing it if no client takes it within REALTIME_POOL_MAX_IDLE"""
+        loop = asyncio.get_running_loop()
+        try:
+            conn = await self._open()
+        except Exception:
+            logger.exception("Failed to pre-warm a Realtime connection")
+            return
+        finally:
+            self._opening -= 1
+
+        entry = (loop.time(), conn, loop.create_future())
+        self._idle.append(entry)
+        try:
+            await asyncio.wait_for(entry[2], REALTIME_POOL_MAX_IDLE)
+        except asyncio.TimeoutError:
+            try:
+                self._idle.remove(entry)
+            except ValueError:
+                return  # acquire() popped it while the timeout was being delivered, and closes it
+            await _close_quietly(conn)
+
+    async def _open(self) -> AsyncRealtimeConnection:
+        conn = await client.realtime.connect(model="gpt-realtime").enter()
+        try:
+            # Configure session with server VAD and medical assistant prompt
+            await conn.session.update(session=SESSION_CONFIG)
+        except BaseException:
+            await _close_quietly(conn)
+            raise
+        logger.debug("Session updated with tools")
+        return conn
 
-class ConnectionManager:
-    """Manages WebSocket connections and Realtime API connections"""
 
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
-        self.realtime_connections: dict[str, AsyncRealtimeConnection] = {}
-        self.sessions: dict[str, Session] = {}
-        self.acc_items: dict[str, dict[str, Any]] = {}
-        self.last_audio_item_ids: dict[str, str | None] = {}
-        self.can_accept_audio: dict[str, bool] = {}
-        self.valid_audio_item_ids: dict[str, set[str]] = {}  # Track valid item_ids per client
-        self.audio_generation: dict[str, int] = {}  # Track audio generation per client
-
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-        self.acc_items[client_id] = {}
-        self.last_audio_item_ids[client_id] = None
-        self.can_accept_audio[client_id] = False
-        self.valid_audio_item_ids[client_id] = set()
-        self.audio_generation[client_id] = 0
+async def _send_frame(conn: AsyncRealtimeConnection, frame: str):
+    """Send an already-serialized client event, skipping the SDK's per-call transform and json.dumps"""
+    send_raw = getattr(conn, "send_raw", None)
+    if send_raw is not None:
+        # Newer SDKs - goes through their reconnect handling like conn.send does
+        await send_raw(frame)
+    else:
+        # The locked 2.x SDK has no raw send - deliberately write to its private websocket
+        await conn._connection.send(frame)
 
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-        if client_id in self.realtime_connections:
-            del self.realtime_connections[client_id]
-        if client_id in self.sessions:
-            del self.sessions[client_id]
-        if client_id in self.acc_items:
-            del self.acc_items[client_id]
-        if client_id in self.last_audio_item_ids:
-            del self.last_audio_item_ids[client_id]
-        if client_id in self.can_accept_audio:
-            del self.can_accept_audio[client_id]
-        if client_id in self.valid_audio_item_ids:
-            del self.valid_audio_item_ids[client_id]
-        if client_id in self.audio_generation:
-            del self.audio_generation[client_id]
-
-    async def send_personal_message(self, message: dict, client_id: str):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_json(message)
-
-    async def handle_realtime_connection(self, client_id: str):
-        """Handle the OpenAI Realtime API connection"""
-        async with client.realtime.connect(model="gpt-realtime") as conn:
-            self.realtime_connections[client_id] = conn
 
-            # Configure session with server VAD and medical assistant prompt
-            tool_def = get_multiply_tool_definition()
-            print(f"Registering tool: {json.dumps(tool_def, indent=2)}")
-
-            await conn.session.update(
-                session={
-                    "instructions": SYSTEM_PROMPT,
-                    "voice": "sage",  # Professional and warm voice
-                    "temperature": 0.7,  # Balanced between consistency and naturalness
-                    "max_response_output_tokens": 4096,
-                    "tools": [tool_def],
-                    "tool_choice": "auto",  # Enable automatic tool calling
-                    "turn_detection": {"type": "server_vad"},  # Match example pattern
-                    "input_audio_transcription": {"model": "whisper-1"},  # Match example
-                    "input_audio_format": "pcm16",  # Match example
-                    "model": "gpt-realtime",
-                    "type": "realtime",
-                }
-            )
-            print("Session updated with tools")
-
-            # Send connection ready message
-            await self.send_personal_message({"type": "connection_ready", "status": "connected"}, client_id)
-
-            async for event in conn:
-                # Debug: log all events temporarily to diagnose
-                event_dict = event.model_dump()
-                if (
-                    "function" in event.type.lower()
-                    or "tool" in event.type.lower()
-                    or "call" in event.type.lower()
-                    or "action" in event.type.lower()
-                ):
-                    print(f"Function/Tool event: {event.type}")
-                    print(f"Event data: {event_dict}")
-
-                # Also log response events to see what's happening
-                if event.type.startswith("response."):
-                    print(f"Response event: {event.type}")
-                    # Log content_part events as they might contain function calls
-                    if event.type == "response.content_part.added":
-                        event_dict = event.model_dump()
-                        print(f"Content part added: {event_dict}")
-                        # Check if it's a function call
-                        if "function" in str(event_dict).lower() or "tool" in str(event_dict).lower():
-                            print(f"FUNCTION CALL IN CONTENT PART: {event_dict}")
-
-                if event.type == "session.created":
-                    self.sessions[client_id] = event.session
-                    if event.session.id:
-                        await self.send_personal_message(
-                            {
-                                "type": "session_created",
-                                "session_id": event.session.id,
-                            },
-                            client_id,
-                        )
-                    continue
-
-                if event.type == "session.updated":
-                    self.sessions[client_id] = event.session
-                    continue
-
-                if event.type == "response.output_audio.delta":
-                    valid_ids = self.valid_audio_item_ids.get(client_id, set())
-                    # If valid_ids is empty, this is the first audio after an interrupt - add it
-                    if len(valid_ids) == 0:
-                        valid_ids.add(event.item_id)
-                        self.valid_audio_item_ids[client_id] = valid_ids
-
-                    # Only send audio if this item_id is valid for the current generation
-                    if event.item_id in valid_ids:
-                        if event.item_id != self.last_audio_item_ids[client_id]:
-                            self.last_audio_item_ids[client_id] = event.item_id
-
-                        # Send audio data to frontend
-                        await self.send_personal_message(
-                            {
-                                "type": "audio_delta",
-                                "item_id": event.item_id,
-                                "delta": event.delta,
-                            },
-                            client_id,
-                        )
-                    # If item_id is not valid, it's from a canceled response - ignore it
-                    continue
-
-                if event.type == "response.output_audio_transcript.delta":
-                    # Only process transcript if this item_id is valid
-                    if event.item_id in self.valid_audio_item_ids.get(client_id, set()):
-                        try:
-                            text = self.acc_items[client_id][event.item_id]
-                        except KeyError:
-                            self.acc_items[client_id][event.item_id] = event.delta
-                        else:
-                            self.acc_items[client_id][event.item_id] = text + event.delta
-
-                        # Send transcript update to frontend
-                        await self.send_personal_message(
-                            {
-                                "type": "transcript_delta",
-                                "item_id": event.item_id,
-                                "text": self.acc_items[client_id][event.item_id],
-                            },
-                            client_id,
-                        )
-                    continue
-
-                # Track new response creation - mark its item_ids as valid
-                if event.type == "response.created":
-                    # New response started - clear old valid IDs, new ones will be added as they arrive
-                    self.valid_audio_item_ids[client_id] = set()
-                    # Log response creation to see if it has function calls
-                    response_dict = event.model_dump()
-                    print(f"RESPONSE CREATED - Full event: {json.dumps(response_dict, indent=2)}")
-                    if "function" in str(response_dict).lower() or "tool" in str(response_dict).lower():
-                        print(f"RESPONSE CREATED WITH FUNCTION: {response_dict}")
-                    continue
-
-                # Check content_part events for function calls - this is where function calls appear in Realtime API
-                if event.type == "response.content_part.added":
-                    event_dict = event.model_dump()
-                    print(f"CONTENT PART ADDED - Full event: {json.dumps(event_dict, indent=2)}")
-
-                    # Try multiple ways to access the part
-                    part = (
-                        getattr(event, "part", None) or event_dict.get("part") or event_dict.get("content_part") or {}
-                    )
+def _is_open(conn: AsyncRealtimeConnection) -> bool:
+    """Whether the underlying websocket has not been closed by either side"""
+    return conn._connection.close_code is None
 
-                    # Check if it's a dict or object
-                    if hasattr(part, "model_dump"):
-                        part = part.model_dump()
-                    elif not isinstance(part, dict):
-                        part = {"raw": str(part)}
-
-                    part_type = part.get("type") if isinstance(part, dict) else None
-                    print(f"Part type: {part_type}, Part data: {part}")
-
-                    # Check for function_call in various formats
-                    function_call = None
-                    tool_call_id = None
-                    function_name = None
-                    arguments = {}
-
-                    # Try different paths to find function call
-                    if part_type == "function_call":
-                        function_call = part.get("function_call") or part
-                    elif "function_call" in part:
-                        function_call = part["function_call"]
-                    elif "function" in str(part).lower():
-                        # Try to extract from part directly
-                        function_call = part
-
-                    if function_call:
-                        if isinstance(function_call, dict):
-                            function_name = (
-                                function_call.get("name") or function_call.get("function_name") or part.get("name")
-                            )
-                            arguments = function_call.get("arguments") or function_call.get("args") or {}
-                            tool_call_id = (
-                                part.get("id")
-                                or function_call.get("id")
-                                or function_call.get("tool_call_id")
-                                or part.get("tool_call_id")
-                            )
-
-                        print(f"FUNCTION CALL FOUND: name={function_name}, id={tool_call_id}, args={arguments}")
-
-                        if function_name == "multiply" and tool_call_id:
-                            try:
-                                if isinstance(arguments, str):
-                                    arguments = json.loads(arguments)
-
-                                a = float(arguments.get("a", 0))
-                                b = float(arguments.get("b", 0))
-                                result = await execute_multiply(a, b)
-
-                                print(f"Multiply result: {result}")
-
-                                await conn.submit_tool_outputs(
-                                    tool_outputs=[
-                                        {
-                                            "tool_call_id": tool_call_id,
-                                            "output": str(result["result"]),
-                                        }
-                                    ]
-                                )
-                                print("Tool output submitted from content_part")
-                            except Exception as e:
-                                print(f"Error in content_part handler: {e}")
-                                import traceback
-
-                                traceback.print_exc()
-                    continue
-
-                # Handle function calls - check multiple event types
-                function_call_handled = False
-                event_dict = event.model_dump()
-
-                # Handle response.requires_action - this is the key event for function calls
-                if event.type == "response.requires_action":
-                    print("RESPONSE REQUIRES ACTION - Function call detected!")
-                    print(f"Full event: {event_dict}")
-
-                    # Get the required action (should contain tool calls)
-                    required_action = getattr(event, "required_action", None) or event_dict.get("required_action", {})
-                    tool_calls = required_action.get("submit_tool_outputs", {}).get("tool_calls", [])
-
-                    if not tool_calls:
-                        # Try alternative paths
-                        tool_calls = event_dict.get("tool_calls", [])
-                        if not tool_calls and "tool_calls" in str(event_dict):
-                            # Try to extract from the event structure
-                            tool_calls = getattr(event, "tool_calls", [])
-
-                    print(f"Tool calls found: {len(tool_calls)}")
-
-                    tool_outputs = []
-                    for tool_call in tool_calls:
-                        tool_call_id = tool_call.get("id") or tool_call.get("tool_call_id")
-                        function_name = tool_call.get("function", {}).get("name") or tool_call.get("name")
-                        arguments_str = tool_call.get("function", {}).get("arguments") or tool_call.get(
-                            "arguments", "{}"
-                        )
-
-                        print(f"Processing tool call: id={tool_call_id}, name={function_name}, args={arguments_str}")
-
-                        if function_name == "multiply" and tool_call_id:
-                            try:
-                                # Parse arguments
-                                if isinstance(arguments_str, str):
-                                    arguments = json.loads(arguments_str)
-                                else:
-                                    arguments = arguments_str
-
-                                a = float(arguments.get("a", 0))
-                                b = float(arguments.get("b", 0))
-                                result = await execute_multiply(a, b)
-
-                                print(f"Multiply result: {result}")
-
-                                tool_outputs.append(
-                                    {
-                                        "tool_call_id": tool_call_id,
-                                        "output": str(result["result"]),
-                                    }
-                                )
-                            except Exception as e:
-                                print(f"Error executing multiply: {e}")
-                                import traceback
-
-                                traceback.print_exc()
-                                tool_outputs.append(
-                                    {
-                                        "tool_call_id": tool_call_id,
-                                        "output": f"Error: {str(e)}",
-                                    }
-                                )
-
-                    if tool_outputs:
-                        print(f"Submitting {len(tool_outputs)} tool outputs")
-                        await conn.submit_tool_outputs(tool_outputs=tool_outputs)
-                        function_call_handled = True
-                        print("Tool outputs submitted successfully")
-
-                # Handle response.function_call_arguments.done - this is the main event for function calls in Realtime API
-                elif event.type == "response.function_call_arguments.done":
-                    # Extract function call details from the event (following the example pattern)
-                    call_id = getattr(event, "call_id", None) or event_dict.get("call_id")
-                    function_name = getattr(event, "name", None) or event_dict.get("name")
-                    arguments_str = getattr(event, "arguments", None) or event_dict.get("arguments", "{}")
-
-                    print(f"Function call detected: name={function_name}, call_id={call_id}, arguments={arguments_str}")
-
-                    if function_name == "multiply" and call_id:
-                        try:
-                            # Parse arguments
-                            if isinstance(arguments_str, str):
-                                arguments = json.loads(arguments_str)
-                            else:
-                                arguments = arguments_str
-
-                            a = float(arguments.get("a", 0))
-                            b = float(arguments.get("b", 0))
-                            result = await execute_multiply(a, b)
-
-                            print(f"Multiply result: {result}")
-
-                            # Submit tool output using conversation.item.create (as per Realtime API pattern)
-                            if ConversationItemParam:
-                                await conn.conversation.item.create(
-                                    item=ConversationItemParam(
-                                        type="function_call_output",
-                                        call_id=call_id,
-                                        output=str(result["result"]),
-                                    )
-                                )
-                            else:
-                                # Fallback to dict format if ConversationItemParam is not available
-                                await conn.conversation.item.create(
-                                    item={
-                                        "type": "function_call_output",
-                                        "call_id": call_id,
-                                        "output": str(result["result"]),
-                                    }
-                                )
-
-                            print("Tool output submitted via conversation.item.create")
-
-                            # Create a new response to continue the conversation
-                            await conn.response.create(
-                                response={
-                                    "instructions": SYSTEM_PROMPT,
-                                }
-                            )
-
-                            function_call_handled = True
-                            print("New response created after tool execution")
-                        except Exception as e:
-                            print(f"Error executing multiply: {e}")
-                            import traceback
-
-                            traceback.print_exc()
-
-                            # Submit error output
-                            if call_id:
-                                if ConversationItemParam:
-                                    await conn.conversation.item.create(
-                                        item=ConversationItemParam(
-                                            type="function_call_output",
-                                            call_id=call_id,
-                                            output=f"Error: {str(e)}",
-                                        )
-                                    )
-                                else:
-                                    # Fallback to dict format
-                                    await conn.conversation.item.create(
-                                        item={
-                                            "type": "function_call_output",
-                                            "call_id": call_id,
-                                            "output": f"Error: {str(e)}",
-                                        }
-                                    )
-
-                            # Create response to inform user of error
-                            await conn.response.create(
-                                response={
-                                    "instructions": "Inform the user that there was an error with the calculation.",
-                                }
-                            )
-
-                            function_call_handled = True
-
-                # Track function call start events
-                if event.type in ["response.function_call_arguments.delta", "response.function_call.delta"]:
-                    name = getattr(event, "name", None) or event_dict.get("name", "unknown")
-                    print(f"Function call delta: {event.type}, name={name}")
-
-                if function_call_handled:
-                    continue
-
-                # Forward other events to frontend
-                await self.send_personal_message({"type": "realtime_event", "event": event.model_dump()}, client_id)
 
+async def _close_quietly(conn: AsyncRealtimeConnection):
+    try:
+        await conn.close()
+    except Exception:
+        pass  # Upstream already dropped it
+
+
+class ClientState:
+    """Per-client WebSocket and Realtime API state"""
+
+    __slots__ = (
+        "websocket",
+        "conn",
+        "session",
+        "can_accept_audio",
+        "audio_generation",
+        "response_generation",
+        "item_generations",
+        "out_queue",
+        "writer_task",
+        "upstream_queue",
+        "pending_cancel",
+        "audio_overloaded",
+    )
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.conn: AsyncRealtimeConnection | None = None
+        self.session: Session | None = None
+        self.can_accept_audio = False
+        self.audio_generation = 0  # Bumped on every new response and every interrupt
+        self.response_generation = 0  # audio_generation when the current response was created
+        self.item_generations: dict[str, int] = {}  # item_id -> generation it was first seen in
+        self.out_queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=OUT_QUEUE_SIZE)
+        self.writer_task: asyncio.Task[None] | None = None
+        self.upstream_queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=UPSTREAM_QUEUE_SIZE)
+        self.pending_cancel: asyncio.Event | None = None  # Set once upstream acknowledges a response.cancel
+        self.audio_overloaded = False  # Audio has been dropped since the queue last had room
+
+    def queue_audio(self, audio: bytes):
+        """Queue a PCM16 audio chunk for upstream, dropping the oldest one if the queue is full"""
+        try:
+            self.upstream_queue.put_nowait(audio)
+            self.audio_overloaded = False
+            return
+        except asyncio.QueueFull:
+            self.upstream_queue.get_nowait()
+            self.upstream_queue.task_done()
+            self.upstream_queue.put_nowait(audio)
+
+        if not self.audio_overloaded:
+            # Warn once per overflow episode - part of the user's speech is being lost
+            self.audio_overloaded = True
+            logger.warning("Upstream audio queue full - dropping the oldest microphone chunks")
+            try:
+                self.out_queue.put_nowait({"type": "overload"})
+            except asyncio.QueueFull:
+                pass  # The client is backed up too; the log is all we can do
+
+    def clear_audio(self):
+        """Discard audio chunks that have not been sent upstream yet"""
+        self.audio_overloaded = False
+        while not self.upstream_queue.empty():
+            self.upstream_queue.get_nowait()
+            self.upstream_queue.task_done()
 
-manager = ConnectionManager()
 
+class ConnectionManager:
+    """Manages WebSocket connections and Realtime API connections"""
 
-@app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+    def __init__(self):
+        self.clients: dict[str, ClientState] = {}
 
-    # Start the realtime connection handler
-    realtime_task = asyncio.create_task(manager.handle_realtime_connection(client_id))
+    async def connect(self, websocket: WebSocket, client_id: str) -> ClientState:
+        await websocket.accept()
+        state = ClientState(websocket)
+        state.writer_task = asyncio.create_task(self._writer(state, client_id))
+        self.clients[client_id] = state
+        return state
 
-    try:
+    def disconnect(self, client_id: str):
+        state = self.clients.pop(client_id, None)
+        if state is not None and state.writer_task is not None:
+            state.writer_task.cancel()
+
+    async def _writer(self, state: ClientState, client_id: str):
+        """Drain the client's outbound queue, sending everything pending as one frame"""
+        websocket = state.websocket
+        queue = state.out_queue
+        try:
+            while True:
+                batch = [await queue.get()]
+                while True:
+                    try:
+                        message = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    _append_to_batch(batch, message)
+
+                if len(batch) == 1:
+                    await websocket.send_bytes(orjson.dumps(batch[0]))
+                else:
+                    await websocket.send_bytes(orjson.dumps({"type": "batch", "items": batch}))
+        except WebSocketDisconnect:
+            pass  # Client went away - the session tears down the rest
+        except Exception:
+            logger.exception("Writer for %s failed", client_id)
+
+    async def handle_realtime_connection(self, state: ClientState, conn: AsyncRealtimeConnection):
+        """Handle events from the OpenAI Realtime API connection"""
+        # Send connection ready message
+        await state.out_queue.put({"type": "connection_ready", "status": "connected"})
+
+        async for event in conn:
+            handler = EVENT_HANDLERS.get(event.type)
+            if handler is not None:
+                await handler(self, state, event)
+                continue
+
+            # Forward other events to frontend
+            await self._forward_event(state, event)
+
+    async def handle_client_messages(self, state: ClientState, conn: AsyncRealtimeConnection):
+        """Handle frames from the frontend until it disconnects"""
+        websocket = state.websocket
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
 
-            if data["type"] == "audio_chunk":
+            # Binary frames are raw PCM16 microphone audio; text frames are JSON control messages
+            audio = message.get("bytes")
+            if audio is not None:
                 # Only accept audio if we're in recording mode
-                if client_id in manager.realtime_connections and manager.can_accept_audio.get(client_id, False):
-                    conn = manager.realtime_connections[client_id]
-                    audio_data = data["audio"]  # Base64 encoded audio
-                    await conn.input_audio_buffer.append(audio=audio_data)
+                if state.can_accept_audio:
+                    state.queue_audio(audio)
+                continue
 
-            elif data["type"] == "start_recording":
+            data = orjson.loads(message["text"])
+
+            if data["type"] == "start_recording":
                 # Cancel any ongoing response, clear buffer, and enable audio acceptance
-                if client_id in manager.realtime_connections:
-                    conn = manager.realtime_connections[client_id]
-                    # Increment generation to invalidate all current audio
-                    manager.audio_generation[client_id] = manager.audio_generation.get(client_id, 0) + 1
-                    # Clear valid item IDs - old response audio will be ignored
-                    manager.valid_audio_item_ids[client_id] = set()
-                    # Cancel any ongoing response first
-                    await conn.send({"type": "response.cancel"})
-                    # Wait a tiny bit to ensure cancel is processed
-                    await asyncio.sleep(0.05)
-                    # Clear input audio buffer to ensure clean start
-                    try:
-                        await conn.input_audio_buffer.clear()
-                    except Exception:
-                        pass  # Buffer might already be empty
-                    # Clear accumulated items
-                    if client_id in manager.acc_items:
-                        manager.acc_items[client_id] = {}
-                    if client_id in manager.last_audio_item_ids:
-                        manager.last_audio_item_ids[client_id] = None
-                    # Now allow audio to be accepted
-                    manager.can_accept_audio[client_id] = True
-                    await manager.send_personal_message({"type": "recording_started"}, client_id)
+                # Increment generation to invalidate all current audio
+                state.audio_generation += 1
+                # Cancel any ongoing response first, and wait until upstream acknowledges it
+                cancelled = state.pending_cancel = asyncio.Event()
+                await conn.send({"type": "response.cancel"})
+                try:
+                    await asyncio.wait_for(cancelled.wait(), timeout=CANCEL_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass  # No acknowledgement - proceed after the old fixed delay
+                state.pending_cancel = None
+                # Clear input audio buffer to ensure clean start
+                state.clear_audio()
+                try:
+                    await conn.input_audio_buffer.clear()
+                except Exception:
+                    pass  # Buffer might already be empty
+                # Now allow audio to be accepted
+                state.can_accept_audio = True
+                await state.out_queue.put({"type": "recording_started"})
 
             elif data["type"] == "hard_stop":
                 # Hard stop - cancel everything immediately
-                if client_id in manager.realtime_connections:
-                    conn = manager.realtime_connections[client_id]
-                    # Stop accepting audio
-                    manager.can_accept_audio[client_id] = False
-                    # Cancel any ongoing response
-                    await conn.send({"type": "response.cancel"})
-                    # Clear input audio buffer
-                    try:
-                        await conn.input_audio_buffer.clear()
-                    except Exception:
-                        pass
-                    # Clear accumulated items
-                    if client_id in manager.acc_items:
-                        manager.acc_items[client_id] = {}
-                    if client_id in manager.last_audio_item_ids:
-                        manager.last_audio_item_ids[client_id] = None
-                    await manager.send_personal_message({"type": "hard_stopped"}, client_id)
+                # Stop accepting audio and invalidate the audio still in flight
+                state.can_accept_audio = False
+                state.audio_generation += 1
+                # Cancel any ongoing response
+                await conn.send({"type": "response.cancel"})
+                # Clear input audio buffer
+                state.clear_audio()
+                try:
+                    await conn.input_audio_buffer.clear()
+                except Exception:
+                    pass
+                await state.out_queue.put({"type": "hard_stopped"})
 
             elif data["type"] == "stop_recording":
                 # Stop accepting audio first
-                manager.can_accept_audio[client_id] = False
-                # Commit audio buffer and create response
-                if client_id in manager.realtime_connections:
-                    conn = manager.realtime_connections[client_id]
-                    await conn.input_audio_buffer.commit()
-                    await conn.response.create(
-                        response={
-                            "instructions": SYSTEM_PROMPT,
-                            # Don't pass tools here - they're already in session.update
+                state.can_accept_audio = False
+                # Let the queued audio reach upstream, then commit it and create a response
+                await state.upstream_queue.join()
+                await conn.input_audio_buffer.commit()
+                await _send_frame(conn, RESPONSE_CREATE_FRAME)
+                await state.out_queue.put({"type": "recording_stopped"})
+
+    async def handle_audio_upload(self, state: ClientState, conn: AsyncRealtimeConnection):
+        """Forward queued microphone audio to the Realtime input buffer"""
+        queue = state.upstream_queue
+        while True:
+            audio = await queue.get()
+            try:
+                # The Realtime API takes base64; encode here, off the receive path
+                await conn.input_audio_buffer.append(audio=base64.b64encode(audio).decode("ascii"))
+            except Exception:
+                logger.exception("Failed to append audio to the Realtime input buffer")
+            finally:
+                queue.task_done()
+
+    async def _forward_event(self, state: ClientState, event: Any):
+        """Forward a Realtime event to the frontend as-is"""
+        # Serialize the model straight to JSON and embed it verbatim, skipping the intermediate dict
+        event_json = orjson.Fragment(event.model_dump_json())
+        await state.out_queue.put({"type": "realtime_event", "event": event_json})
+
+    async def _on_session_created(self, state: ClientState, event: Any):
+        state.session = event.session
+        if event.session.id:
+            await state.out_queue.put(
+                {
+                    "type": "session_created",
+                    "session_id": event.session.id,
+                }
+            )
+
+    async def _on_session_updated(self, state: ClientState, event: Any):
+        state.session = event.session
+
+    async def _on_audio_delta(self, state: ClientState, event: Any):
+        generation = state.audio_generation
+        # Interrupted since this response was created - drop without registering the item
+        if generation != state.response_generation:
+            return
+
+        # A new item_id belongs to the generation it first shows up in
+        item_generation = state.item_generations.setdefault(event.item_id, generation)
+
+        # Only send audio if this item_id is valid for the current generation
+        if item_generation == generation:
+            # Send audio data to frontend
+            await state.out_queue.put(
+                {
+                    "type": "audio_delta",
+                    "item_id": event.item_id,
+                    "delta": event.delta,
+                }
+            )
+        # If item_id is not valid, it's from a canceled response - ignore it
+
+    async def _on_transcript_delta(self, state: ClientState, event: Any):
+        # Only process transcript if this item_id is valid
+        if state.item_generations.get(event.item_id) == state.audio_generation:
+            # Send only the new text - the frontend appends it to the item's transcript
+            await state.out_queue.put(
+                {
+                    "type": "transcript_delta",
+                    "item_id": event.item_id,
+                    "delta": event.delta,
+                }
+            )
+
+    async def _on_response_created(self, state: ClientState, event: Any):
+        # New response started - bump the generation so only its item_ids are valid from here on
+        state.audio_generation += 1
+        state.response_generation = state.audio_generation
+        # Every item seen so far belongs to an older generation - forget them so the dict doesn't grow all session
+        state.item_generations.clear()
+        if _DEBUG:
+            logger.debug(
+                "RESPONSE CREATED - Full event: %s",
+                orjson.dumps(event.model_dump(), option=orjson.OPT_INDENT_2).decode(),
+            )
+
+    async def _on_cancel_ack(self, state: ClientState, event: Any):
+        # A finished (or cancelled) response, or the error for cancelling when nothing was active,
+        # is the acknowledgement start_recording waits for - any other error is just forwarded
+        if state.pending_cancel is not None and (
+            event.type == "response.done" or event.error.code == "response_cancel_not_active"
+        ):
+            state.pending_cancel.set()
+        await self._forward_event(state, event)
+
+    async def _on_content_part_added(self, state: ClientState, event: Any):
+        # Check content_part events for function calls - this is where function calls appear in Realtime API
+        if _DEBUG:
+            logger.debug(
+                "CONTENT PART ADDED - Full event: %s",
+                orjson.dumps(event.model_dump(), option=orjson.OPT_INDENT_2).decode(),
+            )
+
+        try:
+            part = event.part
+        except AttributeError:
+            part = event.model_dump().get("content_part") or {}
+
+        # Text and audio parts are the common case - only function calls need a closer look
+        part_type = part.get("type") if isinstance(part, dict) else getattr(part, "type", None)
+        logger.debug("Part type: %s, Part data: %s", part_type, part)
+        if part_type != "function_call":
+            return
+
+        if hasattr(part, "model_dump"):
+            part = part.model_dump()
+        function_call = part.get("function_call") or part
+        tool_call_id = None
+        function_name = None
+        arguments = {}
+
+        if function_call:
+            if isinstance(function_call, dict):
+                function_name = function_call.get("name") or function_call.get("function_name") or part.get("name")
+                arguments = function_call.get("arguments") or function_call.get("args") or {}
+                tool_call_id = (
+                    part.get("id")
+                    or function_call.get("id")
+                    or function_call.get("tool_call_id")
+                    or part.get("tool_call_id")
+                )
+
+            logger.debug("FUNCTION CALL FOUND: name=%s, id=%s, args=%s", function_name, tool_call_id, arguments)
+
+            if function_name == "multiply" and tool_call_id:
+                try:
+                    if isinstance(arguments, str):
+                        arguments = orjson.loads(arguments)
+
+                    a = float(arguments.get("a", 0))
+                    b = float(arguments.get("b", 0))
+                    result = execute_multiply(a, b)
+
+                    logger.debug("Multiply result: %s × %s = %s", a, b, result)
+
+                    await state.conn.submit_tool_outputs(
+                        tool_outputs=[
+                            {
+                                "tool_call_id": tool_call_id,
+                                "output": str(result),
+                            }
+                        ]
+                    )
+                    logger.debug("Tool output submitted from content_part")
+                except Exception as e:
+                    logger.exception("Error in content_part handler: %s", e)
+
+    async def _on_requires_action(self, state: ClientState, event: Any):
+        # Handle response.requires_action - this is the key event for function calls
+        logger.debug("RESPONSE REQUIRES ACTION - Function call detected!")
+        logger.debug("Full event: %s", event)
+
+        # Get the required action (should contain tool calls)
+        try:
+            tool_calls = event.required_action.submit_tool_outputs.tool_calls
+        except AttributeError:
+            # Untyped payload - dig through the raw dict instead
+            event_dict = event.model_dump()
+            required_action = event_dict.get("required_action") or {}
+            tool_calls = (required_action.get("submit_tool_outputs") or {}).get("tool_calls")
+            if not tool_calls:
+                # Some payloads carry the tool calls at the top level instead
+                tool_calls = event_dict.get("tool_calls") or []
+
+        logger.debug("Tool calls found: %s", len(tool_calls))
+
+        tool_outputs = []
+        for tool_call in tool_calls:
+            if hasattr(tool_call, "model_dump"):
+                tool_call = tool_call.model_dump()
+            tool_call_id = tool_call.get("id") or tool_call.get("tool_call_id")
+            function_name = tool_call.get("function", {}).get("name") or tool_call.get("name")
+            arguments_str = tool_call.get("function", {}).get("arguments") or tool_call.get("arguments", "{}")
+
+            logger.debug("Processing tool call: id=%s, name=%s, args=%s", tool_call_id, function_name, arguments_str)
+
+            if function_name == "multiply" and tool_call_id:
+                try:
+                    # Parse arguments
+                    if isinstance(arguments_str, str):
+                        arguments = orjson.loads(arguments_str)
+                    else:
+                        arguments = arguments_str
+
+                    a = float(arguments.get("a", 0))
+                    b = float(arguments.get("b", 0))
+                    result = execute_multiply(a, b)
+
+                    logger.debug("Multiply result: %s × %s = %s", a, b, result)
+
+                    tool_outputs.append(
+                        {
+                            "tool_call_id": tool_call_id,
+                            "output": str(result),
                         }
                     )
-                    await manager.send_personal_message({"type": "recording_stopped"}, client_id)
+                except Exception as e:
+                    logger.exception("Error executing multiply: %s", e)
+                    tool_outputs.append(
+                        {
+                            "tool_call_id": tool_call_id,
+                            "output": f"Error: {str(e)}",
+                        }
+                    )
+
+        if tool_outputs:
+            logger.debug("Submitting %s tool outputs", len(tool_outputs))
+            await state.conn.submit_tool_outputs(tool_outputs=tool_outputs)
+            logger.debug("Tool outputs submitted successfully")
+        else:
+            await self._forward_event(state, event)
+
+    async def _on_function_call_arguments_done(self, state: ClientState, event: Any):
+        # Handle response.function_call_arguments.done - this is the main event for function calls in Realtime API
+        # Extract function call details from the event (following the example pattern)
+        try:
+            call_id = event.call_id
+            function_name = event.name
+            arguments_str = event.arguments or "{}"
+        except AttributeError:
+            # Older SDK models don't declare every field - read them from the raw payload
+            event_dict = event.model_dump()
+            call_id = event_dict.get("call_id")
+            function_name = event_dict.get("name")
+            arguments_str = event_dict.get("arguments") or "{}"
+
+        logger.debug("Function call detected: name=%s, call_id=%s, arguments=%s", function_name, call_id, arguments_str)
+
+        if function_name == "multiply" and call_id:
+            try:
+                # Parse arguments
+                if isinstance(arguments_str, str):
+                    arguments = orjson.loads(arguments_str)
+                else:
+                    arguments = arguments_str
+
+                a = float(arguments.get("a", 0))
+                b = float(arguments.get("b", 0))
+                result = execute_multiply(a, b)
+
+                logger.debug("Multiply result: %s × %s = %s", a, b, result)
+
+                # Submit tool output using conversation.item.create (as per Realtime API pattern)
+                await _submit_tool_output(state.conn, call_id, str(result))
+                logger.debug("Tool output submitted via conversation.item.create")
+
+                # Create a new response to continue the conversation
+                await _send_frame(state.conn, RESPONSE_CREATE_FRAME)
+                logger.debug("New response created after tool execution")
+            except Exception as e:
+                logger.exception("Error executing multiply: %s", e)
+
+                # Submit error output and inform the user
+                await _submit_tool_output(state.conn, call_id, f"Error: {str(e)}")
+                await _send_frame(state.conn, ERROR_RESPONSE_FRAME)
+        else:
+            await self._forward_event(state, event)
+
+
+# Realtime event type -> ConnectionManager handler; anything else is forwarded to the frontend
+EVENT_HANDLERS = {
+    "session.created": ConnectionManager._on_session_created,
+    "session.updated": ConnectionManager._on_session_updated,
+    "response.output_audio.delta": ConnectionManager._on_audio_delta,
+    "response.output_audio_transcript.delta": ConnectionManager._on_transcript_delta,
+    "response.created": ConnectionManager._on_response_created,
+    "response.done": ConnectionManager._on_cancel_ack,
+    "error": ConnectionManager._on_cancel_ack,
+    "response.content_part.added": ConnectionManager._on_content_part_added,
+    "response.requires_action": ConnectionManager._on_requires_action,
+    "response.function_call_arguments.done": ConnectionManager._on_function_call_arguments_done,
+}
+
+manager = ConnectionManager()
+realtime_pool = RealtimeConnectionPool(REALTIME_POOL_SIZE)
+
 
-    except WebSocketDisconnect:
-        realtime_task.cancel()
+@app.websocket("/ws/{client_id}")
+async def websocket_endpoint(websocket: WebSocket, client_id: str):
+    state = await manager.connect(websocket, client_id)
+    try:
+        conn = await realtime_pool.acquire()
+    except Exception:
+        logger.exception("Could not open a Realtime connection for %s", client_id)
+        manager.disconnect(client_id)
+        return
+    state.conn = conn
+
+    tasks = {
+        asyncio.create_task(manager.handle_realtime_connection(state, conn)),
+        asyncio.create_task(manager.handle_client_messages(state, conn)),
+        asyncio.create_task(manager.handle_audio_upload(state, conn)),
+        state.writer_task,
+    }
+    try:
+        # The client disconnecting, the Realtime connection closing or the writer stopping ends the session
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                logger.error("Session %s failed", client_id, exc_info=task.exception())
+    finally:
+        for task in tasks:
+            task.cancel()
+        await _close_quietly(conn)
         manager.disconnect(client_id)
 
 
@@ -1,12 +1,19 @@
 #!/bin/bash
 # Script to run the FastAPI server
+# Set WORKERS (e.g. WORKERS=$(nproc)) to run multiple worker processes without auto-reload
+
+UVICORN_ARGS="--host 0.0.0.0 --port 8000 --loop uvloop --http httptools --ws websockets"
+if [ -n "$WORKERS" ]; then
+    UVICORN_ARGS="$UVICORN_ARGS --workers $WORKERS --log-level warning"
+else
+    UVICORN_ARGS="$UVICORN_ARGS --reload"
+fi
 
 # Check if uv is available
 if command -v uv &> /dev/null; then
     echo "Starting server with uv..."
-    uv run uvicorn api_server:app --reload --host 0.0.0.0 --port 8000
+    uv run uvicorn api_server:app $UVICORN_ARGS
 else
     echo "Starting server with python..."
-    python -m uvicorn api_server:app --reload --host 0.0.0.0 --port 8000
+    python -m uvicorn api_server:app $UVICORN_ARGS
 fi
-
@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+# api_server imports prompt and tools from the backend directory and builds its OpenAI client at import
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import api_server
+from api_server import RealtimeConnectionPool
+
+
+class FakeConnection:
+    """Stands in for AsyncRealtimeConnection, recording whether it was closed"""
+
+    def __init__(self):
+        self.session = SimpleNamespace(update=self._update)
+        self._connection = SimpleNamespace(close_code=None)
+
+    async def _update(self, session: dict):
+        pass
+
+    async def close(self):
+        self._connection.close_code = 1000
+
+    @property
+    def closed(self) -> bool:
+        return self._connection.close_code is not None
+
+
+class FakeRealtime:
+    """Stands in for client.realtime, keeping every connection it opens"""
+
+    def __init__(self):
+        self.opened: list[FakeConnection] = []
+
+    def connect(self, **_: object):
+        return self
+
+    async def enter(self) -> FakeConnection:
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+
+@pytest.fixture
+def realtime(monkeypatch: pytest.MonkeyPatch) -> FakeRealtime:
+    realtime = FakeRealtime()
+    monkeypatch.setattr(api_server, "client", SimpleNamespace(realtime=realtime))
+    return realtime
+
+
+async def _until(condition):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0)
+
+    await asyncio.wait_for(poll(), timeout=1.0)
+
+
+async def test_acquire_warms_pool_to_size(realtime: FakeRealtime):
+    pool = RealtimeConnectionPool(2)
+    conn = await asyncio.wait_for(pool.acquire(), timeout=1.0)
+
+    # One opened inline for the cold pool, then exactly `size` warmed behind it
+    await _until(lambda: len(pool._idle) == 2)
+    assert len(realtime.opened) == 3
+    assert conn is realtime.opened[0]
+
+    await pool.close()
+    assert all(c.closed for c in realtime.opened[1:])
+    assert not conn.closed
+
+
+async def test_acquire_hands_out_prewarmed_connection(realtime: FakeRealtime):
+    pool = RealtimeConnectionPool(2)
+    await pool.acquire()
+    await _until(lambda: len(pool._idle) == 2)
+
+    warm = pool._idle[0][1]
+    assert await asyncio.wait_for(pool.acquire(), timeout=1.0) is warm
+
+    # The taken connection is replaced, not duplicated
+    await _until(lambda: len(pool._idle) == 2)
+    assert len(realtime.opened) == 4
+
+    await pool.close()
+
+
+async def test_expired_connections_are_not_rewarmed(realtime: FakeRealtime, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(api_server, "REALTIME_POOL_MAX_IDLE", 0.01)
+    pool = RealtimeConnectionPool(2)
+    await pool.acquire()
+    await _until(lambda: len(realtime.opened) == 3 and not pool._idle and not pool._warming)
+
+    # Idle connections were closed and nothing reopened them until the next client
+    assert all(c.closed for c in realtime.opened[1:])
+    await pool.close()
@@ -2,31 +2,34 @@
 Multiply tool for OpenAI Realtime API
 """
 
+# Built once at import; the definition never changes between sessions
+_TOOL_DEF = {
+    "type": "function",
+    "name": "multiply",
+    "description": "Multiplies two numbers together. Useful for mathematical calculations.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "a": {
+                "type": "number",
+                "description": "The first number to multiply",
+            },
+            "b": {
+                "type": "number",
+                "description": "The second number to multiply",
+            },
+        },
+        "required": ["a", "b"],
+    },
+}
+
 
 def get_multiply_tool_definition() -> dict:
     """Returns the tool definition for the multiply function"""
-    return {
-        "type": "function",
-        "name": "multiply",
-        "description": "Multiplies two numbers together. Useful for mathematical calculations.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "a": {
-                    "type": "number",
-                    "description": "The first number to multiply",
-                },
-                "b": {
-                    "type": "number",
-                    "description": "The second number to multiply",
-                },
-            },
-            "required": ["a", "b"],
-        },
-    }
+    return _TOOL_DEF
 
 
-async def execute_multiply(a: float, b: float) -> dict:
+def execute_multiply(a: float, b: float) -> float:
     """
     Executes the multiply function
 
@@ -35,10 +38,6 @@ async def execute_multiply(a: float, b: float) -> dict:
         b: Second number
 
     Returns:
-        Dictionary with the result
+        The product of a and b
     """
-    result = a * b
-    return {
-        "result": result,
-        "calculation": f"{a} × {b} = {result}",
-    }
+    return a * b
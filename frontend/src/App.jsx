@@ -25,6 +25,7 @@ function App() {
   const canSendAudioRef = useRef(false)
   const audioGenerationRef = useRef(0) // Track audio generation - increments on each interrupt
   const validItemIdsRef = useRef(new Set()) // Track valid item IDs for current generation
+  const transcriptItemIdRef = useRef(null) // Item whose transcript is currently displayed
 
   useEffect(() => {
     // Generate unique client ID
@@ -32,7 +33,10 @@ function App() {
     
     // Connect to WebSocket
     const ws = new WebSocket(`ws://localhost:8000/ws/${clientIdRef.current}`)
+    // Backend sends orjson-encoded binary frames
+    ws.binaryType = 'arraybuffer'
     wsRef.current = ws
+    const textDecoder = new TextDecoder()
 
     ws.onopen = () => {
       console.log('WebSocket connected')
@@ -41,7 +45,8 @@ function App() {
     }
 
     ws.onmessage = (event) => {
-      const data = JSON.parse(event.data)
+      const text = typeof event.data === 'string' ? event.data : textDecoder.decode(event.data)
+      const data = JSON.parse(text)
       handleWebSocketMessage(data)
     }
 
@@ -88,6 +93,11 @@ function App() {
 
   const handleWebSocketMessage = (data) => {
     switch (data.type) {
+      case 'batch':
+        // Backend coalesces pending messages into one frame - handle each in order
+        data.items.forEach(handleWebSocketMessage)
+        break
+
       case 'connection_ready':
         console.log('Realtime API connected')
         break
@@ -127,7 +137,13 @@ function App() {
         break
       
       case 'transcript_delta':
-        setTranscript(data.text)
+        // Backend sends only new text - append it, or start over for a new item
+        if (data.item_id !== transcriptItemIdRef.current) {
+          transcriptItemIdRef.current = data.item_id
+          setTranscript(data.delta)
+        } else {
+          setTranscript(prev => prev + data.delta)
+        }
         break
       
       case 'audio_delta':
@@ -141,6 +157,11 @@ function App() {
         // If interrupted, ignore all audio until recording_started resets the flag
         break
       
+      case 'overload':
+        // Backend fell behind forwarding microphone audio and dropped some of it
+        console.warn('Audio upload overloaded - some speech was dropped')
+        break
+      
       default:
         console.log('Received message:', data)
     }
@@ -412,6 +433,7 @@ function App() {
     currentItemIdRef.current = null
 
     // Clear transcript when interrupting
+    transcriptItemIdRef.current = null
     setTranscript('')
   }
 
@@ -457,17 +479,10 @@ function App() {
           pcm16[i] = s < 0 ? s * 0x8000 : s * 0x7FFF
         }
 
-        // Convert to base64
-        const base64Audio = btoa(
-          String.fromCharCode.apply(null, new Uint8Array(pcm16.buffer))
-        )
-
         // Only send audio if we're allowed to (recording confirmed started)
+        // Raw PCM16 goes out as a binary frame - the backend base64-encodes it for OpenAI
         if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN && canSendAudioRef.current) {
-          wsRef.current.send(JSON.stringify({
-            type: 'audio_chunk',
-            audio: base64Audio
-          }))
+          wsRef.current.send(pcm16.buffer)
         }
       }
 